@@ -2,6 +2,11 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
+import functools
+import pickle
+import re
+from types import MappingProxyType
+
 # These are columns that contain a scalar value for each event.
 # Other valid columns are "image", "contour", and "trace".
 _columns = [
@@ -45,7 +50,7 @@ _columns = [
    ["inert_ratio_cvx", "Inertia ratio of convex contour sqrt(m20/m02)"],
    ["inert_ratio_raw", "Inertia ratio of raw contour sqrt(m20/m02)"],
    ["index", "Event index"],
-   ["ncells", "Number of cells in image"],
+   ["nevents", "Number of events in image"],
    ["pc1", "Principal component 1"],
    ["pc2", "Principal component 2"],
    ["pos_x", "Position along channel axis [µm]"],
@@ -55,3 +60,42 @@ _columns = [
    ["time", "Event time [s]"],
    ["volume", "Volume [µm³]"],
    ]
+
+# Read-only mapping of column name to description for O(1) lookups;
+# `_columns` retains the original row ordering.
+columns = MappingProxyType(dict(_columns))
+
+# Historical column names from earlier revisions of this list, mapped
+# to their canonical successors. `resolve` turns any (possibly
+# outdated) name into the canonical one with a single dict lookup.
+ALIASES = MappingProxyType({
+    "fc0_max": "fl1_max",
+    "fc0_width": "fl1_width",
+    "inert_ratio": "inert_ratio_cvx",
+    "ncells": "nevents",
+    })
+
+
+def resolve(name):
+    """Return the canonical column name for `name`"""
+    return ALIASES.get(name, name)
+
+
+# The descriptions encode units in square brackets, e.g.
+# "Area [µm²]" -> label "Area", unit "µm²". Parse them once at import
+# so that readers and the writer do not have to string-parse the
+# description on every access.
+_UNIT_RE = re.compile(r'^(.*?)\s*(?:\[(.+?)\])?\s*$')
+COLUMN_META = MappingProxyType(
+    {name: {"label": _UNIT_RE.match(desc).group(1),
+            "unit": _UNIT_RE.match(desc).group(2) or ""}
+     for name, desc in _columns})
+
+
+@functools.lru_cache(maxsize=None)
+def registry_bytes():
+    """Pickled `_columns` for cheap hand-off to worker processes
+
+    See :func:`meta.registry_bytes`.
+    """
+    return pickle.dumps(_columns, protocol=pickle.HIGHEST_PROTOCOL)
@@ -9,10 +9,16 @@ from rtdc_writer import write
 
 
 path = "full_measurement.rtdc"
+# Seeded Generator: reproducible data, faster bit generator than the
+# legacy global np.random singleton, and it can fill existing buffers.
+rng = np.random.default_rng(0xC0FFEE)
 event_count = 10000
 image_shape = (50, 90)
 frame_count = event_count*100
-frames = np.sort(np.random.choice(frame_count, event_count, replace=False))
+# shuffle=False samples without materializing a full frame_count-long
+# permutation; the sample order is irrelevant since we sort in place
+frames = rng.choice(frame_count, event_count, replace=False, shuffle=False)
+frames.sort()
 
 
 meta_data = {
@@ -41,8 +47,6 @@ meta_data = {
         },
     # All imaging-related keywords
     "imaging": {
-        "exposure time": 20,
-        "flash current": 100,
         "flash device": "green LED)",
         "flash duration": 10,
         "frame rate": 2000,
@@ -68,19 +72,31 @@ meta_data = {
 
 
 
-data = {"area_cvx": np.random.normal(100, 5, event_count),
-        "area_msd": np.random.normal(100, 5, event_count) - np.abs(np.random.normal(10, 3, event_count)),
-        "circ": 1 - np.abs(np.random.normal(0, .2, event_count)),
-        "fl1_area": np.random.normal(300, 100, event_count),
+# area_msd and circ combine |N(mu, sigma)| samples; take the absolute
+# value and combine in place so no intermediate arrays materialize
+area_msd = rng.normal(100, 5, event_count)
+msd_offset = rng.normal(10, 3, event_count)
+np.abs(msd_offset, out=msd_offset)
+area_msd -= msd_offset
+
+circ = rng.normal(0, .2, event_count)
+np.abs(circ, out=circ)
+circ *= -1
+circ += 1
+
+data = {"area_cvx": rng.normal(100, 5, event_count),
+        "area_msd": area_msd,
+        "circ": circ,
+        "fl1_area": rng.normal(300, 100, event_count),
         "fl1_dist": np.zeros(event_count),
-        "fl1_max": np.random.normal(1000, 5, event_count),
+        "fl1_max": rng.normal(1000, 5, event_count),
         "fl1_npeaks": np.ones(event_count),
         "fl1_pos": 300 * np.ones(event_count),
-        "fl1_width": np.random.normal(400, 10, event_count),
-        "fl2_max": np.random.normal(2000, 10, event_count),
-        "fl3_max": np.random.normal(1600, 15, event_count),
+        "fl1_width": rng.normal(400, 10, event_count),
+        "fl2_max": rng.normal(2000, 10, event_count),
+        "fl3_max": rng.normal(1600, 15, event_count),
         "frame": frames,
-        "ncells": np.ones(event_count),
+        "nevents": np.ones(event_count),
         "pos_x": np.linspace(image_shape[0]/2 - 10, image_shape[0]/2 + 4, event_count),
         "pos_y": np.linspace(image_shape[0]/2 + 2, image_shape[0]/2 -7, event_count),
         "size_x": np.linspace(22, 21, event_count),
@@ -91,40 +107,56 @@ data = {"area_cvx": np.random.normal(100, 5, event_count),
 contx = np.concatenate((np.arange(20),
                         20*np.ones(20),
                         np.arange(20)[::-1],
-                        np.zeros(20)))
+                        np.zeros(20))).astype(int)
 conty = np.concatenate((20*np.ones(20),
                         np.arange(20)[::-1],
                         np.zeros(20),
-                        np.arange(20)))
+                        np.arange(20))).astype(int)
 
-data["contour"] = []
-for ii in range(event_count):
-    conti = np.zeros((80, 2), dtype=int)
-    x = data["pos_x"][ii]
-    y = data["pos_y"][ii]
-    conti[:, 0] = int(x) + contx.astype(int)
-    conti[:, 1] = int(y) + conty.astype(int)
-    data["contour"].append(conti)
+# One broadcast instead of a Python loop over all events; the
+# contiguous (event_count, 80, 2) block is passed to the writer
+# as-is, where it ends up as a single dataset.
+contours = np.empty((event_count, 80, 2), dtype=int)
+contours[:, :, 0] = data["pos_x"].astype(int)[:, None] + contx[None, :]
+contours[:, :, 1] = data["pos_y"].astype(int)[:, None] + conty[None, :]
+data["contour"] = contours
 
 # image data
-images = np.ones((event_count, image_shape[0], image_shape[1]), dtype=np.uint8)
-for ii in range(event_count):
-    images[ii] += np.random.randint(0, 250, image_shape, dtype=np.uint8)
+# Draw the noise for all events in one RNG call; the "ones" offset is
+# folded into the sampling range so the final uint8 cube is produced
+# in a single pass.
+images = rng.integers(1, 251,
+                      size=(event_count,) + image_shape,
+                      dtype=np.uint8)
+# guard against silent upcasts (integer sampling defaults to int64,
+# which would multiply the memory traffic of this 45 MB cube by 8)
+assert images.dtype == np.uint8
 data["image"] = images
 
 
 # trace data
 xraw = np.linspace(-1, 1, 100)
 med = np.exp(-xraw**2*1e3)
-rawtrace = np.zeros((event_count, med.size))
-medtrace = np.zeros((event_count, med.size))
-for ii in range(event_count):
-    med = np.roll(med, 7)
-    raw = med + np.random.normal(scale=.1, size=100)
-    medtrace[ii] = med
-    rawtrace[ii] = raw
+# Row ii is `med` rolled by 7*(ii+1); one fancy-index gather builds
+# all rows at once instead of allocating a new array per np.roll call.
+# The noise for all events is drawn in a single RNG call as well.
+shifts = 7 * np.arange(1, event_count + 1)
+idx = (np.arange(med.size)[None, :] - shifts[:, None]) % med.size
+medtrace = med[idx]
+# fill the noise buffer in place and reuse it as the raw trace
+rawtrace = rng.standard_normal(medtrace.shape)
+rawtrace *= .1
+rawtrace += medtrace
 data["trace"] = {"fl1_median": medtrace,
                  "fl1_raw": rawtrace,
                  }
 
-write(rtdc_file=path, data=data, meta=meta_data, compression=None)
+# chunk shapes sized so that one chunk is on the order of 1 MiB and
+# matches the typical access pattern (whole columns, image slabs)
+chunk_shapes = {"image": (256, image_shape[0], image_shape[1]),
+                "trace": (2048, 2, 100),
+                "scalar": (65536,),
+                }
+
+write(rtdc_file=path, data=data, meta=meta_data, compression=None,
+      chunks=chunk_shapes)
@@ -1,6 +1,11 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
+
+import functools
+import pickle
+from types import MappingProxyType
+
 # A list of all valid configuration keywords for a measurement.
 # The variable names depict the corresponding section title in
 # a configuration file, e.g.
@@ -15,7 +20,7 @@ from __future__ import unicode_literals
 #    etc.
 
 
-meta = {
+meta_lists = {
     # All parameters related to the actual experiment
     "experiment": [
         # no correspondence
@@ -137,3 +142,33 @@ meta = {
         ["viscosity", float, "Medium viscosity [Pa*s], if 'medium' not given"]
         ],
     }
+
+# Read-only mapping of section name to {key: (type, description)} for
+# O(1) lookups by key name; `meta_lists` (deprecated) retains the
+# original list-of-lists form and with it the row ordering.
+meta = MappingProxyType(
+    {sec: MappingProxyType({name: (typ, desc) for name, typ, desc in rows})
+     for sec, rows in meta_lists.items()})
+
+# Precompiled sets for O(1) validation of user-supplied configuration
+# data (hash lookup instead of scanning the keyword lists per check).
+VALID_SECTIONS = frozenset(meta_lists)
+VALID_KEYS = MappingProxyType(
+    {sec: frozenset(row[0] for row in rows)
+     for sec, rows in meta_lists.items()})
+# (section, key) -> type, for O(1) lookup during value coercion
+TYPES = MappingProxyType(
+    {(sec, row[0]): row[1]
+     for sec, rows in meta_lists.items() for row in rows})
+
+
+@functools.lru_cache(maxsize=None)
+def registry_bytes():
+    """Pickled `meta_lists` for cheap hand-off to worker processes
+
+    Applications that spawn many short-lived workers (multiprocessing,
+    dask) can place these bytes in a shared-memory segment once and
+    `pickle.loads` them in each worker, which is much cheaper than
+    re-importing and re-parsing this module per process.
+    """
+    return pickle.dumps(meta_lists, protocol=pickle.HIGHEST_PROTOCOL)